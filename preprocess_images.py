@@ -6,6 +6,11 @@ Inky Impression 5.7\" 用 事前リサイズスクリプト
 - Inky Impression 5.7\" (600x448) 向けにリサイズ＆中央トリミング
 - JPEG の EXIF (特に DateTimeOriginal) を可能な限りコピー
 - PHOTO_OUT_DIR に保存
+- PRE_PALETTE=1 のときは Inky の 7 色パレットで減色した PNG として保存
+  （切り替え前に書いた別形式の同名ファイルは削除し、同じ写真が二重に並ばないようにする）
+- 出力の方が新しいファイルはスキップ（PRE_FORCE=1 で全件再処理）
+- --watch を付けると、一括処理の前から PHOTO_RAW_DIR を監視して、
+  一括処理中・処理後に追加・更新された画像も処理し続ける（要 watchdog）
 
 想定ディレクトリ構成:
   inky57-slideshow/
@@ -17,10 +22,15 @@ Inky Impression 5.7\" 用 事前リサイズスクリプト
 
 import os
 import sys
+import argparse
 import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from logging.handlers import MemoryHandler, QueueHandler, QueueListener
 from pathlib import Path
 
-from PIL import Image, ImageEnhance
+from PIL import Image, PngImagePlugin
 from dotenv import load_dotenv
 
 # .env 読み込み
@@ -48,35 +58,109 @@ TARGET_HEIGHT = int(os.getenv("INKY_HEIGHT", "448"))
 CONTRAST = float(os.getenv("PRE_CONTRAST", "1.05"))
 SATURATION = float(os.getenv("PRE_SATURATION", "1.00"))
 
+# コントラスト調整用 LUT（中間グレー 128 を中心に伸縮、R/G/B 共通）
+CONTRAST_LUT = [
+    min(255, max(0, round((i - 128) * CONTRAST + 128))) for i in range(256)
+] * 3
+
+# 1 にすると Inky の 7 色パレットで減色（Floyd-Steinberg）した PNG を出力する。
+# slideshow.py はこの PNG を検出すると減色をせずそのままパネルに送る。
+PALETTE_OUTPUT = os.getenv("PRE_PALETTE", "0") == "1"
+
+# 減色時のパレットの彩度（slideshow.py の SATURATION と合わせる）
+PALETTE_SATURATION = float(os.getenv("PRE_PALETTE_SATURATION", "0.85"))
+
+# Inky Impression 5.7" (UC8159) のパレット。インデックス順はドライバと同じ
+# （黒, 白, 緑, 青, 赤, 黄, 橙）で、ドライバ同様に実機の発色と原色を彩度で混ぜる
+INKY_SATURATED_PALETTE = [
+    (57, 48, 57),
+    (255, 255, 255),
+    (58, 91, 70),
+    (61, 59, 94),
+    (156, 72, 75),
+    (208, 190, 71),
+    (177, 106, 73),
+]
+INKY_DESATURATED_PALETTE = [
+    (0, 0, 0),
+    (255, 255, 255),
+    (0, 255, 0),
+    (0, 0, 255),
+    (255, 0, 0),
+    (255, 255, 0),
+    (255, 140, 0),
+]
+
+# 減色済み PNG に付けるテキストチャンクのキー（slideshow.py と共通）
+INKY_PALETTE_MARKER = "inky_palette"
+
+# 1 にすると処理済み（出力の方が新しい）ファイルも再処理する
+FORCE = os.getenv("PRE_FORCE", "0") == "1"
+
 # 対象とする拡張子
 VALID_EXT = (".jpg", ".jpeg", ".png")
 
+# JPEG デコード時の縮小 (draft) で残す解像度の倍率（ターゲット解像度に対して）
+DRAFT_OVERSAMPLE = 2
+
+# 縮小率がこれを超える場合は BILINEAR で 2 倍サイズまで粗く縮小してから LANCZOS をかける
+PRESCALE_THRESHOLD = 3
+
 # ===== ログ設定 =====
 
 LOG_DIR = Path(os.path.expanduser("~/.logs/inky57_preprocess"))
 LOG_DIR.mkdir(parents=True, exist_ok=True)
 LOG_FILE = LOG_DIR / "preprocess_images.log"
 
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+# SD カードへの書き込み回数を減らすため、ファイル出力はまとめて書き出す
+# （ERROR 以上は即時。終了時は logging.shutdown() で残りが flush される）
+_log_file_handler = logging.FileHandler(LOG_FILE, delay=True)
+_log_file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+LOG_BUFFER = MemoryHandler(
+    capacity=256,
+    flushLevel=logging.ERROR,
+    target=_log_file_handler,
+)
+
 logging.basicConfig(
     level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
+    format=LOG_FORMAT,
     handlers=[
-        logging.FileHandler(LOG_FILE),
+        LOG_BUFFER,
         logging.StreamHandler(sys.stdout),
     ],
 )
 logger = logging.getLogger(__name__)
 
 
+def _init_worker(log_queue):
+    """ワーカープロセスのログはキュー経由でメインプロセスのハンドラへ送る"""
+    logging.getLogger().handlers = [QueueHandler(log_queue)]
+
+
 def find_images(src_dir: Path):
     """再帰的に画像ファイルを列挙"""
     if not src_dir.exists():
         return []
 
+    # os.scandir の DirEntry はディレクトリ読み出し時の種別を使うので stat が不要
     files = []
-    for p in src_dir.rglob("*"):
-        if p.is_file() and p.suffix.lower() in VALID_EXT:
-            files.append(p)
+    stack = [str(src_dir)]
+    while stack:
+        path = stack.pop()
+        # 読めない・列挙中に消えたディレクトリは飛ばして続ける
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.lower().endswith(VALID_EXT) and entry.is_file():
+                        files.append(Path(entry.path))
+        except OSError as e:
+            logger.warning(f"ディレクトリを読めないためスキップします: {path} : {e}")
+            continue
     return sorted(files)
 
 
@@ -84,12 +168,42 @@ def resize_and_crop(img: Image.Image, target_w: int, target_h: int) -> Image.Ima
     """
     画像をパネル解像度に合わせてリサイズし、中央トリミング（レターボックス無し）。
     """
-    # まず RGB に固定
-    img = img.convert("RGB")
+    # まず RGB に固定（既に RGB なら全画素のコピーを作らない）
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+
+    src_w, src_h = img.size
+    src_ratio = src_w / src_h
+    tgt_ratio = target_w / target_h
 
-    # コントラスト調整（軽め）
+    # アスペクト比に合わせて、元画像上の中央の切り出し範囲を決める
+    if src_ratio > tgt_ratio:
+        # 横長 → 高さを合わせて左右を切る
+        crop_h = src_h
+        crop_w = src_h * tgt_ratio
+    else:
+        # 縦長 or 同比率 → 幅を合わせて上下を切る
+        crop_w = src_w
+        crop_h = src_w / tgt_ratio
+
+    left = (src_w - crop_w) / 2
+    top = (src_h - crop_h) / 2
+    box = (left, top, left + crop_w, top + crop_h)
+
+    # 中央トリミングは resize(box=...) で縮小と同時に行い、
+    # はみ出し部分を含む中間画像を作らない
+    # 大きく縮小する場合は BILINEAR で中間サイズまで落としてから LANCZOS
+    if max(crop_w / target_w, crop_h / target_h) > PRESCALE_THRESHOLD:
+        img = img.resize(
+            (target_w * 2, target_h * 2), Image.Resampling.BILINEAR, box=box
+        )
+        box = None
+
+    img = img.resize((target_w, target_h), Image.Resampling.LANCZOS, box=box)
+
+    # コントラスト調整（軽め）: 縮小後の小さい画像に LUT で 1 パス適用
     if abs(CONTRAST - 1.0) > 1e-3:
-        img = ImageEnhance.Contrast(img).enhance(CONTRAST)
+        img = img.point(CONTRAST_LUT)
 
     # 彩度調整（必要なら）
     if abs(SATURATION - 1.0) > 1e-3:
@@ -98,30 +212,40 @@ def resize_and_crop(img: Image.Image, target_w: int, target_h: int) -> Image.Ima
         # 必要であればここで実装する。
         pass
 
-    src_w, src_h = img.size
-    src_ratio = src_w / src_h
-    tgt_ratio = target_w / target_h
+    return img
 
-    # アスペクト比に合わせて一辺をフィットさせる
-    if src_ratio > tgt_ratio:
-        # 横長 → 高さを合わせて横はオーバーさせる
-        new_h = target_h
-        new_w = int(new_h * src_ratio)
-    else:
-        # 縦長 or 同比率 → 幅を合わせて縦はオーバーさせる
-        new_w = target_w
-        new_h = int(new_w / src_ratio)
 
-    img = img.resize((new_w, new_h), Image.Resampling.LANCZOS)
+def inky_palette_image() -> Image.Image:
+    """quantize() に渡す Inky 7 色パレットの画像"""
+    palette = []
+    for sat, desat in zip(INKY_SATURATED_PALETTE, INKY_DESATURATED_PALETTE):
+        palette.extend(
+            round(s * PALETTE_SATURATION + d * (1 - PALETTE_SATURATION))
+            for s, d in zip(sat, desat)
+        )
 
-    # 中央トリミング
-    left = (new_w - target_w) // 2
-    top = (new_h - target_h) // 2
-    right = left + target_w
-    bottom = top + target_h
+    # 残りのエントリは黒 (インデックス 0) で埋める。純黒 (0,0,0) で埋めると
+    # 混合後の黒より近いと判定され、パネルに無いインデックスが選ばれてしまう
+    pal_img = Image.new("P", (1, 1))
+    pal_img.putpalette(palette + palette[:3] * (256 - len(INKY_SATURATED_PALETTE)))
+    return pal_img
 
-    img = img.crop((left, top, right, bottom))
-    return img
+
+def remove_other_format(dst_path: Path):
+    """
+    PRE_PALETTE を切り替える前に書いた、同じ画像の別形式の出力を消す。
+    残っていると slideshow が両方を拾い、同じ写真が 2 回表示される。
+    """
+    if PALETTE_OUTPUT:
+        others = (".jpg", ".jpeg", ".JPG", ".JPEG")
+    else:
+        others = (".png", ".PNG")
+
+    for suffix in others:
+        sibling = dst_path.with_suffix(suffix)
+        if sibling.exists():
+            sibling.unlink()
+            logger.info(f"DEL : {sibling} （別形式の古い出力）")
 
 
 def process_one(src_path: Path, dst_root: Path):
@@ -129,55 +253,204 @@ def process_one(src_path: Path, dst_root: Path):
     1ファイル処理:
       - リサイズ & トリミング
       - EXIF を可能な限りコピー
+
+    戻り値: "ok" / "skip" / "fail"
     """
     rel = src_path.relative_to(PHOTO_RAW_DIR)
     dst_path = dst_root / rel
 
     # 出力先の拡張子は JPEG に統一する場合はここで変更
     # 例: PNG も含めて全部 .jpg にしたい場合:
-    if dst_path.suffix.lower() not in (".jpg", ".jpeg"):
+    if PALETTE_OUTPUT:
+        dst_path = dst_path.with_suffix(".png")
+    elif dst_path.suffix.lower() not in (".jpg", ".jpeg"):
         dst_path = dst_path.with_suffix(".jpg")
 
-    dst_path.parent.mkdir(parents=True, exist_ok=True)
-
     try:
+        # 出力の方が新しければ処理済みとみなす
+        # （列挙後に元画像が消えた場合などの OSError は失敗として数える）
+        if (
+            not FORCE
+            and dst_path.exists()
+            and dst_path.stat().st_mtime >= src_path.stat().st_mtime
+        ):
+            remove_other_format(dst_path)
+            return "skip"
+
+        dst_path.parent.mkdir(parents=True, exist_ok=True)
+
         with Image.open(src_path) as img:
             # 元画像の EXIF を取得（JPEG なら多くの場合入っている）
             exif_bytes = img.info.get("exif")
 
+            # JPEG は libjpeg の DCT スケーリングで縮小デコードする（info は保持される）
+            if img.format == "JPEG":
+                img.draft(
+                    "RGB",
+                    (TARGET_WIDTH * DRAFT_OVERSAMPLE, TARGET_HEIGHT * DRAFT_OVERSAMPLE),
+                )
+
             resized = resize_and_crop(img, TARGET_WIDTH, TARGET_HEIGHT)
 
             save_kwargs = {
-                "quality": 90,
                 "optimize": True,
             }
             # EXIF があれば付けて保存（DateTimeOriginal などを保持）
             if exif_bytes is not None:
                 save_kwargs["exif"] = exif_bytes
 
-            resized.save(dst_path, format="JPEG", **save_kwargs)
+            # 一時ファイルに書いてから置き換える（--watch で一括処理と同じ画像を
+            # 同時に書いても、slideshow が書き込み途中のファイルを読んでも壊れない）
+            tmp_path = dst_path.with_name(f".{dst_path.name}.{os.getpid()}.tmp")
+
+            try:
+                if PALETTE_OUTPUT:
+                    pnginfo = PngImagePlugin.PngInfo()
+                    pnginfo.add_text(INKY_PALETTE_MARKER, "7")
+
+                    quantized = resized.quantize(
+                        palette=inky_palette_image(),
+                        dither=Image.Dither.FLOYDSTEINBERG,
+                    )
+                    quantized.save(tmp_path, format="PNG", pnginfo=pnginfo, **save_kwargs)
+                else:
+                    resized.save(tmp_path, format="JPEG", quality=90, **save_kwargs)
+
+                os.replace(tmp_path, dst_path)
+            except Exception:
+                tmp_path.unlink(missing_ok=True)
+                raise
+
+        remove_other_format(dst_path)
 
         logger.info(f"OK  : {src_path} → {dst_path}")
+        return "ok"
 
     except Exception as e:
         logger.error(f"FAIL: {src_path} → {dst_path} : {e}")
+        return "fail"
+
+
+def process_all(images):
+    """一括処理: 1 ファイルごとに独立しているので CPU コア数だけ並列に処理する"""
+    log_queue = multiprocessing.Queue()
+    listener = QueueListener(log_queue, *logging.getLogger().handlers)
+    listener.start()
+
+    try:
+        with ProcessPoolExecutor(
+            max_workers=os.cpu_count(),
+            initializer=_init_worker,
+            initargs=(log_queue,),
+        ) as ex:
+            results = list(
+                ex.map(
+                    partial(process_one, dst_root=PHOTO_OUT_DIR),
+                    images,
+                    chunksize=4,
+                )
+            )
+    finally:
+        listener.stop()
+
+    logger.info(
+        f"処理: {results.count('ok')} 件 / "
+        f"スキップ: {results.count('skip')} 件 / "
+        f"失敗: {results.count('fail')} 件"
+    )
+
+
+def start_watch(src_dir: Path, dst_root: Path):
+    """
+    src_dir の監視を開始し、書き込み完了・移動してきた画像をその都度処理する。
+    一括処理の前に呼び、処理中に追加された画像も取りこぼさないようにする。
+    watchdog が必要（pip install watchdog）。開始できなければ None を返す。
+    """
+    try:
+        from watchdog.events import FileSystemEventHandler
+        from watchdog.observers import Observer
+    except ImportError:
+        logger.error("--watch には watchdog が必要です: pip install watchdog")
+        return None
+
+    class ImageEventHandler(FileSystemEventHandler):
+        def _handle(self, path):
+            path = Path(path)
+            if path.suffix.lower() not in VALID_EXT or path.name.startswith("."):
+                return
+
+            # 例外で watchdog のディスパッチスレッドが止まらないよう、ここで捕まえる
+            try:
+                process_one(path, dst_root)
+            except Exception as e:
+                logger.error(f"FAIL: {path} : {e}")
+
+            # 常駐中はファイルごとにログを書き出す
+            LOG_BUFFER.flush()
+
+        # 書き込み途中のファイルを読まないよう、作成・更新ではなく
+        # クローズ (IN_CLOSE_WRITE) と移動 (rsync などの rename) を拾う
+        def on_closed(self, event):
+            if not event.is_directory:
+                self._handle(event.src_path)
+
+        def on_moved(self, event):
+            if not event.is_directory:
+                self._handle(event.dest_path)
+
+    observer = Observer()
+    try:
+        observer.schedule(ImageEventHandler(), str(src_dir), recursive=True)
+        observer.start()
+    except OSError as e:
+        logger.error(f"監視を開始できませんでした: {src_dir} : {e}")
+        return None
+
+    logger.info(f"監視を開始しました: {src_dir}")
+    return observer
+
+
+def watch(observer):
+    """監視スレッドが終わるか Ctrl+C まで待つ"""
+    logger.info("一括処理が終わりました。監視を続けます（Ctrl+C で終了）")
+
+    try:
+        while observer.is_alive():
+            observer.join(1)
+    except KeyboardInterrupt:
+        logger.info("監視を終了します。")
+    finally:
+        observer.stop()
+        observer.join()
 
 
 def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="PHOTO_RAW_DIR を監視し、一括処理中・処理後に追加・更新された画像も処理し続ける（要 watchdog）",
+    )
+    args = parser.parse_args()
+
     logger.info("=== preprocess_images: start ===")
     logger.info(f"入力ディレクトリ: {PHOTO_RAW_DIR}")
     logger.info(f"出力ディレクトリ: {PHOTO_OUT_DIR}")
     logger.info(f"ターゲット解像度: {TARGET_WIDTH}x{TARGET_HEIGHT}")
 
+    # 監視は一括処理より先に始める（処理中に追加された画像も拾うため。
+    # 一括処理と重なった画像は process_one の更新日時チェックでスキップされる）
+    observer = start_watch(PHOTO_RAW_DIR, PHOTO_OUT_DIR) if args.watch else None
+
     images = find_images(PHOTO_RAW_DIR)
-    if not images:
+    if images:
+        logger.info(f"処理対象ファイル数: {len(images)}")
+        process_all(images)
+    else:
         logger.warning("処理対象の画像が見つかりませんでした。")
-        return
-
-    logger.info(f"処理対象ファイル数: {len(images)}")
 
-    for src in images:
-        process_one(src, PHOTO_OUT_DIR)
+    if observer is not None:
+        watch(observer)
 
     logger.info("=== preprocess_images: done ===")
 
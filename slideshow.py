@@ -3,31 +3,71 @@
 Inky Impression 5.7" 7色版 スライドショー
 
 重要:
-- Pillow側での強制7色減色はしない
-- Inkyライブラリ側の色変換に任せる
+- Pillow側で独自のパレットによる強制7色減色はしない
+- 色変換は Inky ライブラリのパレット（SATURATION で混合したもの）と同じディザで、
+  1 枚につき 1 回だけ行ってからパネルに送る（表示リトライで減色し直さない）
+  （preprocess_images.py を PRE_PALETTE=1 で実行して減色済みの PNG は、
+    パレットのインデックスのままパネルに送る）
 - images/photo/ と images/art/ を再帰的に読む
 """
 
 import os
 import time
+import hashlib
 import random
 import logging
 import json
-from datetime import datetime
+import struct
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from functools import lru_cache
 
-from PIL import Image, ImageDraw, ImageFont, ImageEnhance
-import piexif
+from PIL import Image, ImageDraw, ImageFile, ImageFont, PngImagePlugin
 from inky.auto import auto
 from dotenv import load_dotenv
 
 load_dotenv()
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-STATE_FILE = os.path.expanduser("~/.cache/slideshow_state_57.json")
+# 表示順のパス一覧（キュー再生成時のみ書き込み）と、現在位置（8 バイト）
+STATE_PATHS_FILE = os.path.expanduser("~/.cache/slideshow_paths_57.json")
+STATE_POS_FILE = os.path.expanduser("~/.cache/slideshow_pos_57")
+
+# 日付を重ねる前のパネル用画像のキャッシュ
+PREPARED_CACHE_DIR = os.path.expanduser("~/.cache/slideshow_57_prepared")
+# 処理内容を変えたときに上げる（古いキャッシュを使わないようにする）
+PREPARED_CACHE_VERSION = 1
 
 PANEL_WIDTH = 600
 PANEL_HEIGHT = 448
 
+# 同期途中などで末尾が欠けた画像も、読めた範囲で表示する
+ImageFile.LOAD_TRUNCATED_IMAGES = True
+
+# 巨大な画像で Pi のメモリを使い切らないよう上限を下げる
+# （超えると DecompressionBombWarning、2 倍を超えると読み込みエラー）
+Image.MAX_IMAGE_PIXELS = 40_000_000
+
+# JPEG デコード時の縮小 (draft) で残す解像度の倍率（パネル解像度に対して）
+DRAFT_OVERSAMPLE = 2
+
+# 元画像とリサイズ後のサイズ差がこの割合以下なら LANCZOS ではなく BILINEAR を使う
+NEAR_SIZE_TOLERANCE = 0.2
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+# EXIF タグ: Exif IFD へのポインタ / DateTimeOriginal
+EXIF_IFD_POINTER = 0x8769
+EXIF_DATETIME_ORIGINAL = 0x9003
+
+# preprocess_images.py が減色済み PNG に付けるテキストチャンクのキー
+INKY_PALETTE_MARKER = "inky_palette"
+
+# Inky の 7 色パレット上のインデックス（減色済み画像に日付を描くときに使う）
+INKY_BLACK = 0
+INKY_WHITE = 1
+
 CONFIG = {
     "PHOTO_DIR": os.path.join(SCRIPT_DIR, os.getenv("PHOTO_DIR", "images")),
     "FONT_PATH": os.getenv(
@@ -47,6 +87,9 @@ CONFIG = {
     "SATURATION": 0.85,
     "PHOTO_CONTRAST": 1.15,
     "ART_CONTRAST": 1.04,
+
+    # 日付を重ねる前の画像キャッシュの上限（古く使われていないものから削除）
+    "PREPARED_CACHE_MAX_MB": 200,
 }
 
 
@@ -76,44 +119,106 @@ def setup_logging():
 logger = setup_logging()
 
 
-def save_state(queue, total_count):
+# 最後に書き込んだ表示位置（同じ位置の書き込みを省く）
+_last_saved_position = None
+
+
+def save_queue(paths, order):
+    """
+    キュー再生成時に 1 回だけ書き出す。
+    パスは PHOTO_DIR からの相対パスでソートして保存し、表示順はそのインデックスで持つ。
+    """
     state = {
-        "total_count": total_count,
-        "queue": queue,
+        "paths": [os.path.relpath(p, CONFIG["PHOTO_DIR"]) for p in paths],
+        "order": list(order),
     }
 
     try:
-        os.makedirs(os.path.dirname(STATE_FILE), exist_ok=True)
+        os.makedirs(os.path.dirname(STATE_PATHS_FILE), exist_ok=True)
+
+        # 書き込み途中で落ちても壊れないよう、一時ファイルに書いてから置き換える
+        tmp_file = STATE_PATHS_FILE + ".tmp"
+        with open(tmp_file, "w") as f:
+            f.write(json.dumps(state, separators=(",", ":")))
+        os.replace(tmp_file, STATE_PATHS_FILE)
 
-        with open(STATE_FILE, "w") as f:
-            json.dump(state, f)
+        # 位置は新しい表示順の先頭から数え直す
+        if os.path.exists(STATE_POS_FILE):
+            os.remove(STATE_POS_FILE)
 
-        logger.info(f"状態保存: 残り {len(queue)} / {total_count} 枚")
+        global _last_saved_position
+        _last_saved_position = 0
+
+        logger.info(f"表示順を保存: {len(order)} 枚")
 
     except Exception as e:
         logger.error(f"状態ファイル保存エラー: {e}")
 
 
+def save_state(position, total_count):
+    global _last_saved_position
+
+    # 前回保存から位置が変わっていなければ書き込まない
+    if position == _last_saved_position:
+        return
+
+    try:
+        os.makedirs(os.path.dirname(STATE_POS_FILE), exist_ok=True)
+
+        tmp_file = STATE_POS_FILE + ".tmp"
+        with open(tmp_file, "wb") as f:
+            f.write(struct.pack("<Q", position))
+        os.replace(tmp_file, STATE_POS_FILE)
+        _last_saved_position = position
+
+        logger.info(f"状態保存: 残り {total_count - position} / {total_count} 枚")
+
+    except Exception as e:
+        logger.error(f"状態ファイル保存エラー: {e}")
+
+
+def clear_state():
+    global _last_saved_position
+    _last_saved_position = None
+
+    for path in (STATE_PATHS_FILE, STATE_POS_FILE):
+        if os.path.exists(path):
+            os.remove(path)
+
+
 def load_state():
-    if not os.path.exists(STATE_FILE):
-        return 0, []
+    if not os.path.exists(STATE_PATHS_FILE):
+        return [], [], 0
 
     try:
-        with open(STATE_FILE, "r") as f:
+        with open(STATE_PATHS_FILE, "r") as f:
             state = json.load(f)
 
-        if isinstance(state, dict):
-            count = state.get("total_count", 0)
-            queue = state.get("queue", [])
-            logger.info(f"状態復元: 残り {len(queue)} / {count} 枚")
-            return count, queue
+        if not isinstance(state, dict) or "order" not in state:
+            logger.info("旧フォーマットの状態ファイルを検出しました。リセットします。")
+            return [], [], 0
+
+        paths = [os.path.join(CONFIG["PHOTO_DIR"], p) for p in state.get("paths", [])]
+        order = state["order"]
+        position = 0
+
+        if os.path.exists(STATE_POS_FILE):
+            with open(STATE_POS_FILE, "rb") as f:
+                (position,) = struct.unpack("<Q", f.read(8))
 
-        logger.info("旧フォーマットの状態ファイルを検出しました。リセットします。")
-        return 0, []
+        if position > len(order) or any(not 0 <= i < len(paths) for i in order):
+            logger.info("状態ファイルの内容が不正です。リセットします。")
+            return [], [], 0
+
+        global _last_saved_position
+        _last_saved_position = position
+
+        logger.info(f"状態復元: 残り {len(order) - position} / {len(order)} 枚")
+        return paths, order, position
 
     except Exception as e:
         logger.error(f"状態ファイル読込エラー: {e}")
-        return 0, []
+        return [], [], 0
 
 
 def detect_image_mode(image_path: str) -> str:
@@ -128,40 +233,70 @@ def detect_image_mode(image_path: str) -> str:
     return "photo"
 
 
-def collect_images():
-    image_paths = []
+# ディレクトリごとの一覧キャッシュ: path -> (mtime_ns, 画像パス, サブディレクトリ)
+_dir_snapshots = {}
 
-    for root, dirs, files in os.walk(CONFIG["PHOTO_DIR"]):
-        dirs[:] = [d for d in dirs if not d.startswith(".")]
 
-        for filename in files:
-            if filename.startswith("."):
-                continue
+def _scan_dir(path):
+    """
+    ディレクトリ直下の画像とサブディレクトリを返す。
+    ディレクトリの mtime が前回と同じ（直下の追加・削除・改名が無い）なら前回の結果を使う。
+    """
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        _dir_snapshots.pop(path, None)
+        return [], []
 
-            if filename.lower().endswith((".jpg", ".jpeg", ".png")):
-                image_paths.append(os.path.join(root, filename))
+    snapshot = _dir_snapshots.get(path)
+    if snapshot is not None and snapshot[0] == mtime:
+        return snapshot[1], snapshot[2]
 
-    return image_paths
+    files = []
+    subdirs = []
 
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
 
-def extract_capture_date(image_path):
-    ext = os.path.splitext(image_path)[1].lower()
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    files.append(entry.path)
+    except OSError:
+        return [], []
 
-    if ext == ".png":
-        return None
+    _dir_snapshots[path] = (mtime, files, subdirs)
+    return files, subdirs
+
+
+def collect_images():
+    image_paths = []
+    stack = [CONFIG["PHOTO_DIR"]]
 
+    while stack:
+        files, subdirs = _scan_dir(stack.pop())
+        image_paths.extend(files)
+        stack.extend(subdirs)
+
+    return image_paths
+
+
+def extract_capture_date_from_img(img):
+    """開いている画像の EXIF から DateTimeOriginal を取得する"""
     try:
-        exif_dict = piexif.load(image_path)
-        date_bytes = exif_dict["Exif"].get(piexif.ExifIFD.DateTimeOriginal)
+        exif = img.getexif()
+        date_str = exif.get_ifd(EXIF_IFD_POINTER).get(EXIF_DATETIME_ORIGINAL)
 
-        if not date_bytes:
+        if not date_str:
             return None
 
-        date_str = date_bytes.decode("utf-8")
-        return datetime.strptime(date_str, "%Y:%m:%d %H:%M:%S")
+        return datetime.strptime(date_str.strip("\x00 "), "%Y:%m:%d %H:%M:%S")
 
     except Exception as e:
-        logger.warning(f"EXIF 取得エラー ({os.path.basename(image_path)}): {e}")
+        logger.warning(f"EXIF 取得エラー ({os.path.basename(img.filename)}): {e}")
         return None
 
 
@@ -169,51 +304,84 @@ def format_date_and_elapsed_time(capture_date):
     if not capture_date:
         return "Unknown date", "Unknown date"
 
-    formatted_date = capture_date.strftime("%Y-%m-%d")
-    delta = datetime.now() - capture_date
+    # 日単位で結果は変わらないので、撮影日と今日の日付（序数）をキーにキャッシュする
+    return _format_date_and_elapsed(
+        capture_date.toordinal(),
+        date.today().toordinal(),
+    )
 
-    years = delta.days // 365
+
+@lru_cache(maxsize=4096)
+def _format_date_and_elapsed(capture_ord, today_ord):
+    capture_day = date.fromordinal(capture_ord)
+    today = date.fromordinal(today_ord)
+
+    formatted_date = capture_day.strftime("%Y-%m-%d")
+
+    # 暦の上での満月数（うるう年や月の長さに左右されない）
+    months = (today.year - capture_day.year) * 12 + (today.month - capture_day.month)
+    if today.day < capture_day.day:
+        months -= 1
+
+    years = months // 12
 
     if years > 0:
         elapsed = f"{years} year{'s' if years > 1 else ''} ago"
+    elif months > 0:
+        elapsed = f"{months} month{'s' if months > 1 else ''} ago"
     else:
-        months = delta.days // 30
-
-        if months > 0:
-            elapsed = f"{months} month{'s' if months > 1 else ''} ago"
-        else:
-            elapsed = "Within a month"
+        elapsed = "Within a month"
 
     return formatted_date, elapsed
 
 
-def enhance_image(img, image_mode: str):
-    if image_mode == "art":
-        return ImageEnhance.Contrast(img).enhance(CONFIG["ART_CONTRAST"])
+def _contrast_lut(factor):
+    # 中間グレー 128 を中心に伸縮する LUT（R/G/B 共通）
+    return [min(255, max(0, round((i - 128) * factor + 128))) for i in range(256)] * 3
+
 
-    return ImageEnhance.Contrast(img).enhance(CONFIG["PHOTO_CONTRAST"])
+CONTRAST_LUTS = {
+    "photo": _contrast_lut(CONFIG["PHOTO_CONTRAST"]),
+    "art": _contrast_lut(CONFIG["ART_CONTRAST"]),
+}
 
 
-def _load_font(size):
+def enhance_image(img, image_mode: str):
+    return img.point(CONTRAST_LUTS.get(image_mode, CONTRAST_LUTS["photo"]))
+
+
+@lru_cache(maxsize=8)
+def _get_font(path, size):
     try:
-        return ImageFont.truetype(CONFIG["FONT_PATH"], size)
+        return ImageFont.truetype(path, size)
     except Exception:
         logger.warning(
-            f"フォント {CONFIG['FONT_PATH']} が見つからないため、デフォルトフォントを使用します。"
+            f"フォント {path} が見つからないため、デフォルトフォントを使用します。"
         )
         return ImageFont.load_default()
 
 
-def add_date_overlay(img, capture_date):
-    draw = ImageDraw.Draw(img)
+def _load_font(size):
+    return _get_font(CONFIG["FONT_PATH"], size)
 
+
+@lru_cache(maxsize=64)
+def _text_bbox(text, font_path, size):
+    return _get_font(font_path, size).getbbox(text)
+
+
+@lru_cache(maxsize=64)
+def _overlay_tile(formatted_date, elapsed_time, mode):
+    """
+    白地に日付と経過時間を描いた不透明なタイルを作る。
+    文言は 1 日ごとにしか変わらないので、描画は日に 1 回で済み、各スライドでは paste するだけになる。
+    P 画像にはパレット番号のまま描いた P タイルを、それ以外には RGB タイルを返す。
+    """
     date_font = _load_font(CONFIG["DATE_FONT_SIZE"])
     elapsed_font = _load_font(CONFIG["FONT_SIZE"])
 
-    formatted_date, elapsed_time = format_date_and_elapsed_time(capture_date)
-
-    date_bbox = draw.textbbox((0, 0), formatted_date, font=date_font)
-    elapsed_bbox = draw.textbbox((0, 0), elapsed_time, font=elapsed_font)
+    date_bbox = _text_bbox(formatted_date, CONFIG["FONT_PATH"], CONFIG["DATE_FONT_SIZE"])
+    elapsed_bbox = _text_bbox(elapsed_time, CONFIG["FONT_PATH"], CONFIG["FONT_SIZE"])
 
     date_w = date_bbox[2] - date_bbox[0]
     date_h = date_bbox[3] - date_bbox[1]
@@ -224,36 +392,173 @@ def add_date_overlay(img, capture_date):
     max_width = max(date_w, elapsed_w)
     total_height = date_h + CONFIG["TEXT_PADDING"] + elapsed_h
 
-    margin = CONFIG["MARGIN"]
     padding = CONFIG["BACKGROUND_PADDING"]
 
-    position = random.choice(CONFIG["DATE_POSITIONS"])
+    if mode == "P":
+        background, foreground = INKY_WHITE, INKY_BLACK
+    else:
+        mode, background, foreground = "RGB", "white", "black"
 
-    x = img.width - max_width - margin - padding if "right" in position else margin + padding
-    y = img.height - total_height - margin - padding if "bottom" in position else margin + padding
-
-    draw.rectangle(
-        (
-            x - padding,
-            y - padding,
-            x + max_width + padding,
-            y + total_height + padding,
-        ),
-        fill="white",
+    # 以前の rectangle と同じく右下端を含むので +1
+    tile = Image.new(
+        mode,
+        (max_width + padding * 2 + 1, total_height + padding * 2 + 1),
+        background,
     )
 
-    draw.text((x, y), formatted_date, fill="black", font=date_font)
+    draw = ImageDraw.Draw(tile)
+    draw.text((padding, padding), formatted_date, fill=foreground, font=date_font)
     draw.text(
-        (x, y + date_h + CONFIG["TEXT_PADDING"]),
+        (padding, padding + date_h + CONFIG["TEXT_PADDING"]),
         elapsed_time,
-        fill="black",
+        fill=foreground,
         font=elapsed_font,
     )
 
+    return tile
+
+
+def add_date_overlay(img, capture_date):
+    formatted_date, elapsed_time = format_date_and_elapsed_time(capture_date)
+    tile = _overlay_tile(formatted_date, elapsed_time, img.mode)
+
+    margin = CONFIG["MARGIN"]
+
+    position = random.choice(CONFIG["DATE_POSITIONS"])
+
+    x = img.width - (tile.width - 1) - margin if "right" in position else margin
+    y = img.height - (tile.height - 1) - margin if "bottom" in position else margin
+
+    # タイルは不透明なのでマスクなしで貼り付ける
+    img.paste(tile, (x, y))
+
     return img
 
 
-def prepare_image(image_path):
+def _fast_to_rgb(img):
+    """
+    モードに応じて最短の経路で 8bit RGB にする。
+    - RGB: 既に RGB なのでそのまま返す（全画素のコピーを作らない）
+    - I;16 系 (16bit グレースケール PNG など): convert("RGB") だけだと 255 で飽和して
+      真っ白になるので、上位 8bit に縮めてから変換する
+    - それ以外 (RGBA / P / CMYK / L など): convert("RGB")。RGBA はアルファを捨てるだけ
+    """
+    if img.mode == "RGB":
+        return img
+
+    if img.mode.startswith("I;16"):
+        return img.convert("I").point(lambda i: i * (1 / 256)).convert("L").convert("RGB")
+
+    return img.convert("RGB")
+
+
+def is_inky_palette_image(img):
+    """preprocess_images.py (PRE_PALETTE=1) で 7 色パレットに減色済みの画像か"""
+    return (
+        img.mode == "P"
+        and img.size == (PANEL_WIDTH, PANEL_HEIGHT)
+        and INKY_PALETTE_MARKER in img.info
+    )
+
+
+def prepared_cache_path(image_path, image_mode):
+    contrast = CONFIG["ART_CONTRAST"] if image_mode == "art" else CONFIG["PHOTO_CONTRAST"]
+    key = (
+        f"{PREPARED_CACHE_VERSION}|{image_path}|{os.stat(image_path).st_mtime_ns}|"
+        f"{PANEL_WIDTH}x{PANEL_HEIGHT}|{contrast}"
+    )
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+    return os.path.join(PREPARED_CACHE_DIR, digest + ".png")
+
+
+def load_prepared(cache_path):
+    """キャッシュがあれば (日付を重ねる前の画像, 撮影日) を返す"""
+    if not os.path.exists(cache_path):
+        return None
+
+    try:
+        with Image.open(cache_path) as cached:
+            img = cached.copy()
+            date_str = cached.info.get("capture_date")
+
+        # 最終利用日時として更新（削除は古いものから）
+        os.utime(cache_path)
+
+        capture_date = datetime.fromisoformat(date_str) if date_str else None
+        return img, capture_date
+
+    except Exception as e:
+        logger.warning(f"キャッシュ読込エラー ({os.path.basename(cache_path)}): {e}")
+        return None
+
+
+def save_prepared(cache_path, img, capture_date):
+    try:
+        os.makedirs(PREPARED_CACHE_DIR, exist_ok=True)
+
+        pnginfo = PngImagePlugin.PngInfo()
+        pnginfo.add_text("capture_date", capture_date.isoformat() if capture_date else "")
+
+        tmp_file = cache_path + ".tmp"
+        img.save(tmp_file, format="PNG", compress_level=1, pnginfo=pnginfo)
+        os.replace(tmp_file, cache_path)
+
+        evict_prepared_cache()
+
+    except Exception as e:
+        logger.warning(f"キャッシュ保存エラー ({os.path.basename(cache_path)}): {e}")
+
+
+def evict_prepared_cache():
+    max_bytes = CONFIG["PREPARED_CACHE_MAX_MB"] * 1024 * 1024
+
+    files = []
+    with os.scandir(PREPARED_CACHE_DIR) as entries:
+        for entry in entries:
+            if entry.is_file():
+                st = entry.stat()
+                files.append((st.st_mtime, st.st_size, entry.path))
+
+    total = sum(size for _, size, _ in files)
+
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+
+        os.remove(path)
+        total -= size
+
+
+def build_palette_image(inky_display):
+    """
+    ドライバが set_image の中で減色に使うのと同じパレットの画像を作る。
+    ドライバがパレットを公開していなければ None（減色は set_image に任せる）。
+    """
+    palette_blend = getattr(inky_display, "_palette_blend", None)
+
+    if palette_blend is None:
+        return None
+
+    try:
+        palette = [int(v) for v in palette_blend(CONFIG["SATURATION"])]
+    except Exception as e:
+        logger.warning(f"パレット取得エラー（減色はドライバに任せます）: {e}")
+        return None
+
+    palette_img = Image.new("P", (1, 1))
+    palette_img.putpalette(palette + [0, 0, 0] * (256 - len(palette) // 3))
+    return palette_img
+
+
+def to_panel_image(img, palette_img):
+    """ドライバと同じパレット・ディザ（Floyd-Steinberg）で減色した "P" 画像にする"""
+    if palette_img is None or img.mode == "P":
+        return img
+
+    return img.quantize(palette=palette_img, dither=Image.Dither.FLOYDSTEINBERG)
+
+
+def prepare_image(image_path, palette_img=None):
     try:
         image_mode = detect_image_mode(image_path)
 
@@ -262,55 +567,124 @@ def prepare_image(image_path):
         )
 
         with Image.open(image_path) as original_img:
-            rgb_img = original_img.convert("RGB")
-            enhanced_img = enhance_image(rgb_img, image_mode)
+            # パネルサイズの画像（preprocess_images.py の出力など）はそのまま読むほうが
+            # キャッシュの PNG より小さく速いので、縮小が必要な画像だけキャッシュする
+            use_cache = original_img.size != (PANEL_WIDTH, PANEL_HEIGHT)
+
+            if use_cache:
+                cache_path = prepared_cache_path(image_path, image_mode)
+                cached = load_prepared(cache_path)
+
+                if cached is not None:
+                    logger.info("処理済みキャッシュを使用します")
+                    cropped_img, capture_date = cached
+                    with_date = add_date_overlay(cropped_img, capture_date)
+                    return to_panel_image(with_date, palette_img)
+
+            capture_date = extract_capture_date_from_img(original_img)
+
+            if is_inky_palette_image(original_img):
+                logger.info("減色済み画像を検出 → リサイズ・減色をスキップ")
+                return add_date_overlay(original_img.copy(), capture_date)
+
+            if original_img.format == "JPEG":
+                original_img.draft(
+                    "RGB",
+                    (PANEL_WIDTH * DRAFT_OVERSAMPLE, PANEL_HEIGHT * DRAFT_OVERSAMPLE),
+                )
+
+            rgb_img = _fast_to_rgb(original_img)
 
             target_width = PANEL_WIDTH
             target_height = PANEL_HEIGHT
 
-            if enhanced_img.size == (target_width, target_height):
+            if rgb_img.size == (target_width, target_height):
                 logger.info(
-                    f"最適化済みサイズを検出: {enhanced_img.size} → リサイズをスキップ"
+                    f"最適化済みサイズを検出: {rgb_img.size} → リサイズをスキップ"
                 )
-                cropped_img = enhanced_img
+                cropped_img = rgb_img
             else:
-                img_ratio = enhanced_img.width / enhanced_img.height
+                img_ratio = rgb_img.width / rgb_img.height
                 target_ratio = target_width / target_height
 
+                # 元画像上でパネルと同じ比率になる中央の切り出し範囲
                 if img_ratio > target_ratio:
-                    new_height = target_height
-                    new_width = int(target_height * img_ratio)
+                    crop_height = rgb_img.height
+                    crop_width = crop_height * target_ratio
                 else:
-                    new_width = target_width
-                    new_height = int(target_width / img_ratio)
+                    crop_width = rgb_img.width
+                    crop_height = crop_width / target_ratio
+
+                left = (rgb_img.width - crop_width) / 2
+                top = (rgb_img.height - crop_height) / 2
+                box = (left, top, left + crop_width, top + crop_height)
+
+                # 2 倍サイズ以上ある分は reduce()（整数倍のボックスフィルタ）で先に縮める
+                reduce_factor = max(
+                    1,
+                    min(
+                        int(crop_width // (target_width * 2)),
+                        int(crop_height // (target_height * 2)),
+                    ),
+                )
+                if reduce_factor > 1:
+                    rgb_img = rgb_img.reduce(
+                        reduce_factor,
+                        box=tuple(round(v) for v in box),
+                    )
+                    crop_width, crop_height = rgb_img.size
+                    box = None
+
+                # reduce 後の残りの縮小や、ほぼパネルサイズの画像（事前リサイズ済みなど）は
+                # BILINEAR で十分
+                size_mismatch = max(
+                    abs(1 - crop_width / target_width),
+                    abs(1 - crop_height / target_height),
+                )
+                resample = (
+                    Image.Resampling.BILINEAR
+                    if reduce_factor > 1 or size_mismatch <= NEAR_SIZE_TOLERANCE
+                    else Image.Resampling.LANCZOS
+                )
 
-                resized_img = enhanced_img.resize(
-                    (new_width, new_height),
-                    resample=Image.Resampling.LANCZOS,
+                # 中央トリミングは resize の box で縮小と同時に行う
+                cropped_img = rgb_img.resize(
+                    (target_width, target_height),
+                    resample=resample,
+                    box=box,
                 )
 
-                left = (new_width - target_width) // 2
-                top = (new_height - target_height) // 2
+            # コントラストは縮小後のパネルサイズの画像にかける
+            cropped_img = enhance_image(cropped_img, image_mode)
 
-                cropped_img = resized_img.crop(
-                    (
-                        left,
-                        top,
-                        left + target_width,
-                        top + target_height,
-                    )
-                )
+            # 日付（経過時間）は表示のたびに変わるので、重ねる前の状態を保存しておく
+            if use_cache:
+                save_prepared(cache_path, cropped_img, capture_date)
 
-            capture_date = extract_capture_date(image_path)
             with_date = add_date_overlay(cropped_img, capture_date)
 
-            return with_date.convert("RGB")
+            return to_panel_image(with_date, palette_img)
 
     except Exception as e:
         logger.error(f"画像処理エラー [{os.path.basename(image_path)}]: {str(e)[:200]}")
         return None
 
 
+def refill_queue():
+    """全画像から表示順を作り直す。画像が 1 枚も無ければ None"""
+    all_files = collect_images()
+
+    if not all_files:
+        return None
+
+    photo_paths = sorted(all_files)
+    order = list(range(len(photo_paths)))
+    random.shuffle(order)
+    save_queue(photo_paths, order)
+
+    return photo_paths, deque(order)
+
+
 def main():
     logger.info('=== Inky Impression 5.7" スライドショーを起動します ===')
 
@@ -332,6 +706,8 @@ def main():
         logger.error(f"ディスプレイ初期化エラー: {e}")
         return
 
+    palette_img = build_palette_image(inky_display)
+
     photo_dir = CONFIG["PHOTO_DIR"]
 
     if not os.path.isdir(photo_dir):
@@ -341,42 +717,50 @@ def main():
     current_files = collect_images()
     current_file_count = len(current_files)
 
-    saved_count, display_queue = load_state()
+    # display_queue は photo_paths へのインデックスを表示順に持つ
+    photo_paths, order, position = load_state()
+    saved_count = len(photo_paths)
+    display_queue = deque(order[position:])
 
     if current_file_count != saved_count:
         logger.info(
             f"画像数の変動を検知: 前回 {saved_count} 枚 → 現在 {current_file_count} 枚。"
             "キューをリセットします。"
         )
-        display_queue = []
+        display_queue = deque()
 
     total_in_cycle = current_file_count
 
+    # 待機時間中に次の画像を先に処理しておく（Pillow の重い処理は GIL を解放する）
+    executor = ThreadPoolExecutor(max_workers=1)
+    prefetched = None  # (image_path, Future)
+
     while True:
         try:
             if not display_queue:
                 logger.info("表示キューが空です。全画像から新しいキューを生成します。")
 
-                all_files = collect_images()
+                refilled = refill_queue()
 
-                if not all_files:
+                if refilled is None:
                     logger.error(f"画像ファイルが 1 枚も見つかりません: {photo_dir}")
 
-                    if os.path.exists(STATE_FILE):
-                        os.remove(STATE_FILE)
+                    clear_state()
 
                     time.sleep(60)
                     continue
 
-                random.shuffle(all_files)
-                display_queue = all_files
+                photo_paths, display_queue = refilled
                 total_in_cycle = len(display_queue)
 
-            image_path = display_queue.pop(0)
+            image_path = photo_paths[display_queue.popleft()]
+
+            prefetched_path, prefetched_future = prefetched or (None, None)
+            prefetched = None
 
             if not os.path.exists(image_path):
                 logger.warning(f"存在しない画像をスキップします: {image_path}")
-                save_state(display_queue, total_in_cycle)
+                save_state(total_in_cycle - len(display_queue), total_in_cycle)
                 continue
 
             logger.info(
@@ -384,7 +768,10 @@ def main():
                 f"/ mode={detect_image_mode(image_path)}"
             )
 
-            processed_image = prepare_image(image_path)
+            if prefetched_path == image_path:
+                processed_image = prefetched_future.result()
+            else:
+                processed_image = prepare_image(image_path, palette_img)
 
             if processed_image is None:
                 logger.error(
@@ -406,7 +793,7 @@ def main():
                             f"(attempt={attempt})"
                         )
 
-                        save_state(display_queue, total_in_cycle)
+                        save_state(total_in_cycle - len(display_queue), total_in_cycle)
                         success = True
                         break
 
@@ -419,6 +806,23 @@ def main():
                         f"連続表示エラーのためスキップ: {os.path.basename(image_path)}"
                     )
 
+            # 1 周したら待機前に次のキューを作り、先読みできるようにする
+            if not display_queue:
+                logger.info("表示キューが空です。全画像から新しいキューを生成します。")
+
+                refilled = refill_queue()
+
+                if refilled is not None:
+                    photo_paths, display_queue = refilled
+                    total_in_cycle = len(display_queue)
+
+            if display_queue:
+                next_path = photo_paths[display_queue[0]]
+                prefetched = (
+                    next_path,
+                    executor.submit(prepare_image, next_path, palette_img),
+                )
+
             interval = CONFIG["INTERVAL_SECONDS"]
             logger.info(f"次の表示まで {interval} 秒待機します...")
             time.sleep(interval)
@@ -431,6 +835,7 @@ def main():
             logger.error(f"予期しないエラー: {e}")
             time.sleep(10)
 
+    executor.shutdown(wait=False)
     logger.info("=== スライドショーを終了しました ===")
 
 